@@ -17,7 +17,13 @@ from app.helpers.message_parser import (
     parse_incoming_message,
     InvalidMessageException,
 )
-from app.helpers.transfer import TransferPartException, TransferException, Transfer
+from app.helpers.transfer import (
+    TransferPartException,
+    TransferPartPermanentException,
+    TransferException,
+    Transfer,
+    ssh_pool,
+)
 from app.services.rabbit import RabbitClient
 from app.services.pulsar import PulsarClient
 from app.services.vault import VaultClient
@@ -68,7 +74,13 @@ class EventListener:
         # Start the transfer
         try:
             Transfer(transfer_message, self.vault_client).transfer()
-        except (TransferPartException, TransferException, OSError, ValueError) as transfer_error:
+        except (
+            TransferPartException,
+            TransferPartPermanentException,
+            TransferException,
+            OSError,
+            ValueError,
+        ) as transfer_error:
             self.log.error(
                 f"Transfer failed - {transfer_error}", transfer_message=transfer_message
             )
@@ -153,3 +165,5 @@ class EventListener:
         self.rabbit_client.connection.close()
         # Close the Pulsar producer(s)
         self.pulsar_client.close()
+        # Close the idle SSH connections
+        ssh_pool.close()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import threading
+from collections import defaultdict, deque
+from typing import Deque, Dict, Tuple
+
+from paramiko import AutoAddPolicy, SSHClient
+
+
+def is_active(client: SSHClient) -> bool:
+    """Check if the connection of the SSH client is still active."""
+    transport = client.get_transport()
+    return transport is not None and transport.is_active()
+
+
+class SSHPool:
+    """Pool of SSH connections, keyed by host, port and username.
+
+    A connection is handed out to one transfer at a time. When the transfer is
+    done, the connection is released back into the pool so a next transfer to
+    the same remote server doesn't need to connect and authenticate again.
+    """
+
+    def __init__(self, keepalive_interval: int = 30):
+        """Initialize a SSHPool.
+
+        Args:
+            keepalive_interval: The interval in seconds of the keepalive packets
+                sent over the connections, so idle connections aren't dropped.
+        """
+        self.keepalive_interval = keepalive_interval
+        self.lock = threading.Lock()
+        # Idle connections per key
+        self.idle_clients: Dict[Tuple[str, int, str], Deque[SSHClient]] = defaultdict(
+            deque
+        )
+        # Key of the connections that are handed out
+        self.client_keys: Dict[SSHClient, Tuple[str, int, str]] = {}
+
+    def acquire(
+        self, host: str, port: int, username: str, password: str, reuse: bool = True
+    ) -> SSHClient:
+        """Get a connected SSH client for the remote server.
+
+        An idle connection is reused if it is still active. Otherwise, a new
+        connection is made. The host keys will be automatically added.
+
+        Args:
+            host: The host of the remote server.
+            port: The SSH port of the remote server.
+            username: The username to connect with.
+            password: The password to connect with.
+            reuse: Whether an idle connection may be reused. If not, a new
+                connection is always made.
+
+        Returns:
+            The connected SSH client.
+        """
+        key = (host, port, username)
+        with self.lock:
+            idle_clients = self.idle_clients[key]
+            while reuse and idle_clients:
+                client = idle_clients.pop()
+                if is_active(client):
+                    self.client_keys[client] = key
+                    return client
+                client.close()
+
+        # Connect outside of the lock, as it takes a few round-trips
+        client = SSHClient()
+        client.set_missing_host_key_policy(AutoAddPolicy())
+        try:
+            client.connect(host, port=port, username=username, password=password)
+            client.get_transport().set_keepalive(self.keepalive_interval)
+        except BaseException:
+            # A failed connect can leave the transport thread and socket running
+            client.close()
+            raise
+        with self.lock:
+            self.client_keys[client] = key
+        return client
+
+    def release(self, client: SSHClient):
+        """Release the SSH client back into the pool.
+
+        If the connection is not active anymore, it will be closed instead.
+
+        Args:
+            client: The SSH client as returned by `acquire`.
+        """
+        with self.lock:
+            key = self.client_keys.pop(client, None)
+            if key and is_active(client):
+                self.idle_clients[key].append(client)
+                return
+        client.close()
+
+    def discard(self, client: SSHClient):
+        """Close the SSH client without releasing it back into the pool.
+
+        Args:
+            client: The SSH client as returned by `acquire`.
+        """
+        with self.lock:
+            self.client_keys.pop(client, None)
+        client.close()
+
+    def close(self):
+        """Close all the idle connections."""
+        with self.lock:
+            for idle_clients in self.idle_clients.values():
+                while idle_clients:
+                    idle_clients.pop().close()
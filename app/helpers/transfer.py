@@ -1,21 +1,26 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import os
+import re
 import shlex
 import threading
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from logging import WARNING, getLogger
 from socket import gaierror
 from ftplib import FTP, error_perm
-from typing import List
+from typing import List, Optional, Set, Tuple
 from urllib.parse import urlparse
 
 import requests
-from paramiko import AutoAddPolicy, SSHClient, SSHException
+from paramiko import SSHClient, SSHException
+from requests.adapters import HTTPAdapter
 from retry import retry
+from urllib3.util.retry import Retry
 from viaa.configuration import ConfigParser
 from viaa.observability import logging
 from hvac.exceptions import InvalidPath, Forbidden
 
+from app.helpers.ssh_pool import SSHPool
 from app.services.vault import VaultClient
 
 
@@ -23,13 +28,53 @@ config_parser = ConfigParser()
 config = config_parser.app_cfg
 log = logging.get_logger(__name__, config=config_parser)
 dest_conf = config["destination"]
+# SSH connections shared by the transfers of this worker
+ssh_pool = SSHPool()
+# Paramiko logs every channel event, only keep its warnings and errors
+getLogger("paramiko").setLevel(WARNING)
+# Shared HTTP session so connections to the source are kept alive and reused
+http_session = requests.Session()
+# Retry transient errors of the source, with backoff, on the pooled connections
+for prefix in ("http://", "https://"):
+    http_session.mount(
+        prefix,
+        HTTPAdapter(
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.5,
+                status_forcelist=[500, 502, 503, 504],
+                raise_on_status=False,
+            )
+        ),
+    )
+# Maximum amount of parts a file is split up in
 NUMBER_PARTS = 4
+# Minimum size of a part, smaller files are split up in less parts
+MIN_PART_SIZE = 64 * 1024 * 1024
+# Default amount of sessions (channels) sshd allows per SSH connection
+MAX_SESSIONS = 10
+# Format of the cURL write-out ("-w") parameter
+CURL_WRITE_OUT = "%{http_code},time: %{time_total}s,size: %{size_download} bytes,speed: %{speed_download}b/s"
+# Static start of the cURL command, shell-escaped once
+CURL_COMMAND_PREFIX = shlex.join(["curl", "-w", CURL_WRITE_OUT, "-L"])
+# Client errors that can be resolved by retrying the request
+RETRYABLE_CLIENT_ERRORS = (408, 429)
+# A closed range of bytes: "{x}-{y}"
+RANGE_RE = re.compile(r"(\d+)-(\d+)")
+# Output of the cURL write-out ("-w") parameter
+CURL_OUT_RE = re.compile(r"(\d+),time: ([\d.]+)s,size: (\d+) bytes,speed: ([\d.]+)b/s")
 
 
 class TransferPartException(Exception):
     pass
 
 
+class TransferPartPermanentException(Exception):
+    """The part can't be transferred, retrying the request won't help."""
+
+    pass
+
+
 class TransferException(Exception):
     pass
 
@@ -63,6 +108,43 @@ def calculate_ranges(size_bytes: int, number_parts: int) -> List[str]:
     return ranges
 
 
+def calculate_number_parts(
+    size_bytes: int, min_part_size: int = MIN_PART_SIZE, max_parts: int = NUMBER_PARTS
+) -> int:
+    """Calculate the amount of parts to split up a file in.
+
+    Each part costs a separate cURL request, so small files are split up in
+    less parts, each of at least the minimum part size.
+
+    Args:
+        size_bytes: The size of the file in bytes.
+        min_part_size: The minimum size of a part in bytes.
+        max_parts: The maximum amount of parts.
+
+    Returns:
+        The amount of parts, between 1 and the maximum amount of parts.
+    """
+    return max(1, min(max_parts, -(-size_bytes // min_part_size)))
+
+
+def calculate_part_size(part_range: str, size_bytes: int) -> int:
+    """Calculate the amount of bytes cURL downloads for a range.
+
+    The end of the last range is the size of the file, while the last byte of
+    the file is at position size - 1.
+
+    Args:
+        part_range: The range of the part in format "{x}-{y}"
+            with x, y integers and x<=y.
+        size_bytes: The size of the file in bytes.
+
+    Returns:
+        The size of the part in bytes.
+    """
+    start, end = (int(position) for position in part_range.split("-"))
+    return min(end, size_bytes - 1) - start + 1
+
+
 def build_curl_command(
     destination: str,
     source_url: str,
@@ -88,12 +170,14 @@ def build_curl_command(
 
     Returns:
         The cURL command shell-escaped
+
+    Raises:
+        ValueError: If the range is not closed, e.g. "{x}-".
     """
+    match = RANGE_RE.fullmatch(part_range)
+    if not match or int(match.group(1)) > int(match.group(2)):
+        raise ValueError(f"Range is not closed: '{part_range}'")
     command = [
-        "curl",
-        "-w",
-        "%{http_code},time: %{time_total}s,size: %{size_download} bytes,speed: %{speed_download}b/s",
-        "-L",
         "-H",
         f"host: {s3_domain}",
         "-H",
@@ -108,7 +192,31 @@ def build_curl_command(
     if source_username and source_password:
         command.extend(["-u", f"{source_username}:{source_password}"])
     command.append(source_url)
-    return shlex.join(command)
+    return f"{CURL_COMMAND_PREFIX} {shlex.join(command)}"
+
+
+def parse_curl_write_out(line: str) -> Optional[Tuple[int, float, int, float]]:
+    """Parse the write-out of the cURL command.
+
+    Args:
+        line: A line of the output of the cURL command, e.g.
+            "206,time: 5s,size: 1000 bytes,speed: 200b/s".
+
+    Returns:
+        The HTTP status code, the total time in seconds, the downloaded size in
+        bytes and the download speed in bytes per second. None if the line is not
+        the write-out.
+    """
+    match = CURL_OUT_RE.match(line)
+    if not match:
+        return None
+    status_code, time_total, size_download, speed_download = match.groups()
+    return (
+        int(status_code),
+        float(time_total),
+        int(size_download),
+        float(speed_download),
+    )
 
 
 def build_assemble_command(
@@ -134,6 +242,80 @@ def build_assemble_command(
     return shlex.join(assemble_command).replace("'&&'", "&&").replace("'>'", ">")
 
 
+def build_finalize_command(
+    tmp_folder: str,
+    dest_file_basename: str,
+    destination: str,
+    size_bytes: int,
+) -> str:
+    """Build the finalize command.
+
+    Command consists of outputting the size of the assembled tmp file (stat) and,
+    only if (&&) that size is the expected size, moving the tmp file to the
+    destination (ln and rm), touching it (touch) and removing the tmp folder with
+    the parts in it (rm -rf). Chaining these steps in one command saves a
+    round-trip per step.
+
+    The tmp file is hard linked as the destination instead of renamed (mv), as
+    linking fails if the destination already exists. A file that appeared at the
+    destination during the transfer is never overwritten. On filesystems without
+    hard links, e.g. SMB/CIFS or FUSE mounts, the tmp file is renamed instead, but
+    only if the destination doesn't exist ([ ! -e ]). Like the SFTP server does,
+    this leaves a small window in which a file can appear at the destination.
+
+    The destination file is touched so MH picks it up. Explicitly use a `touch`
+    as `SFTP utime` doesn't work.
+
+    Args:
+        tmp_folder: The tmp folder containing the parts, ending in ".part".
+        dest_file_basename: The basename of the destination file.
+        destination: Full filename path of destination file.
+        size_bytes: The expected size of the assembled file in bytes.
+
+    Returns:
+        The finalize command shell-escaped.
+
+    Raises:
+        ValueError: If the tmp folder doesn't end in ".part", as it is removed
+            recursively.
+    """
+    if not tmp_folder.endswith(".part"):
+        raise ValueError(f"Not a tmp folder: '{tmp_folder}'")
+    tmp_file = shlex.quote(os.path.join(tmp_folder, f"{dest_file_basename}.tmp"))
+    dest_file = shlex.quote(destination)
+    return (
+        f'size=$(stat -c %s {tmp_file}) && echo "$size"'
+        f' && test "$size" -eq {int(size_bytes)}'
+        f" && {{ ln {tmp_file} {dest_file}"
+        f" || {{ [ ! -e {dest_file} ] && mv {tmp_file} {dest_file}; }}; }}"
+        f" && rm -f {tmp_file}"
+        f" && touch {dest_file}"
+        f" && rm -rf {shlex.quote(tmp_folder)}"
+    )
+
+
+def build_free_space_command(folder: str, interval: int = 120) -> str:
+    """Build the free space command.
+
+    Command consists of a remote loop that outputs the used space in percentage
+    of the filesystem of the folder (df) every `interval` seconds. The loop stops
+    when the output can't be written anymore, e.g. when the channel is closed,
+    or when the used space can't be determined.
+
+    Args:
+        folder: A folder on the filesystem to check.
+        interval: The amount of seconds between two checks.
+
+    Returns:
+        The free space command shell-escaped.
+    """
+    df_command = f"df --output=pcent {shlex.quote(folder)} | tail -1"
+    return (
+        f'while out=$({df_command}) && [ -n "$out" ] && echo "$out";'
+        f" do sleep {int(interval)}; done"
+    )
+
+
 def calculate_filename_part(file: str, idx: int, directory: str = None) -> str:
     """Convenience method for calculating the filename of a part."""
     part = f"{file}.part{idx}"
@@ -152,6 +334,8 @@ class Transfer:
                 filename."""
         self.domain = message["source"]["headers"].get("host")
         self.destination_path = message["destination"]["path"]
+        # Logger with the destination bound to every log line of this transfer
+        self.log = log.bind(destination=self.destination_path)
 
         self.dest_folder_dirname = os.path.dirname(self.destination_path)
         self.dest_file_basename = os.path.basename(self.destination_path)
@@ -163,10 +347,18 @@ class Transfer:
         )
 
         self.source_url = message["source"]["url"]
+        self.source_url_parsed = urlparse(self.source_url)
         self.size_in_bytes = 0
+        self.number_parts = NUMBER_PARTS
+        # Indexes of the parts that are already transferred
+        self.transferred_parts = set()
+        # Index and range of the parts written by this transfer. A retry only
+        # resumes from these, never from parts another transfer left behind.
+        self.written_parts: Set[Tuple[int, str]] = set()
 
         # SSH client
         self.remote_client = None
+        self.remote_client_lock = threading.Lock()
         # SFTP client
         self.sftp = None
 
@@ -201,33 +393,100 @@ class Transfer:
             self.source_password = vault_client.get_password(secret_path_source)
 
     def _init_remote_client(self):
-        # SSH client
-        self.remote_client = SSHClient()
-        self.remote_client.set_missing_host_key_policy(AutoAddPolicy())
-        self.remote_client.connect(
-            self.remote_server_host,
-            port=22,
-            username=self.host_username,
-            password=self.host_password,
-        )
-        # SFTP client
-        self.sftp = self.remote_client.open_sftp()
+        """Acquire a SSH client from the pool and open a SFTP client on it.
+
+        A pooled connection can be dropped after its last keepalive while it is
+        still reported as active. If opening the SFTP client fails, the
+        connection is discarded and a new one is made, once.
+
+        The clients are only assigned once both are usable, as the threads
+        transferring the parts may be reading them.
+
+        Raises:
+            TransferException: If the SFTP client can't be opened on a new
+                connection either.
+        """
+        for reuse in (True, False):
+            # SSH client, reused from the pool if possible
+            remote_client = ssh_pool.acquire(
+                self.remote_server_host,
+                22,
+                self.host_username,
+                self.host_password,
+                reuse=reuse,
+            )
+            try:
+                # SFTP client
+                sftp = remote_client.open_sftp()
+            except SSHException as ssh_e:
+                ssh_pool.discard(remote_client)
+                if not reuse:
+                    self.log.error(f"SSH Error occurred when opening SFTP: {ssh_e}")
+                    raise TransferException
+                self.log.warning(f"SSH connection not usable, reconnecting: {ssh_e}")
+            else:
+                self.remote_client = remote_client
+                self.sftp = sftp
+                return
+
+    def _close_remote_client(self):
+        """Close the SFTP client and release the SSH client back into the pool."""
+        if self.sftp:
+            self.sftp.close()
+            self.sftp = None
+        if self.remote_client:
+            ssh_pool.release(self.remote_client)
+            self.remote_client = None
 
-    @retry(TransferPartException, tries=3, delay=3, logger=log)
+    def _ensure_remote_client(self) -> SSHClient:
+        """Reconnect the SSH client if its connection has been lost.
+
+        The SSH client is shared by the threads transferring the parts, so
+        reconnecting is guarded by a lock.
+
+        Returns:
+            The SSH client, checked under the lock.
+
+        Raises:
+            TransferPartException: If there is no SSH client.
+        """
+        with self.remote_client_lock:
+            if self.remote_client is None:
+                self.log.error("No SSH client to transfer the part with")
+                raise TransferPartException
+            transport = self.remote_client.get_transport()
+            if transport is None or not transport.is_active():
+                self.log.warning("SSH connection lost, reconnecting")
+                ssh_pool.discard(self.remote_client)
+                self._init_remote_client()
+            return self.remote_client
+
+    @retry(
+        TransferPartException, tries=3, delay=3, backoff=2, jitter=(0, 1), logger=log
+    )
     def _transfer_part(
         self,
         dest_file_full: str,
         part_range: str,
     ):
-        """Connect to a remote server via SSH and download a part via cURL.
+        """Download a part via cURL on the remote server.
+
+        The cURL command is executed in a new channel of the SSH connection of the
+        transfer, so the parts don't need to connect to the remote server
+        themselves.
 
-        Connecting to the server is via user/pass. The host keys will be automatically
-        added.
+        Failures are retried with an exponential backoff, except for client
+        errors such as a 404 or 416 which won't be resolved by retrying.
 
         Args:
             dest_file_full: The full filename of the destination file.
             part_range: The range of the part to fetch in format "{x}-{y}"
                 with x, y integers and x<=y.
+
+        Raises:
+            TransferPartException: If the part failed to transfer after retrying.
+            TransferPartPermanentException: If the source responds with a client
+                error.
         """
         # Build the cURL command
         curl_cmd = build_curl_command(
@@ -238,53 +497,97 @@ class Transfer:
             source_username=self.source_username,
             source_password=self.source_password,
         )
-        with SSHClient() as remote_client:
-            try:
-                remote_client.set_missing_host_key_policy(AutoAddPolicy())
-                remote_client.connect(
-                    self.remote_server_host,
-                    port=22,
-                    username=self.host_username,
-                    password=self.host_password,
+        try:
+            remote_client = self._ensure_remote_client()
+            # Execute the cURL command and examine results
+            _stdin, stdout, stderr = remote_client.exec_command(curl_cmd)
+            # Stop reading as soon as the write-out line is received
+            results = None
+            for line in stdout:
+                results = parse_curl_write_out(line)
+                if results:
+                    break
+            err = stderr.readlines()
+            if err:
+                self.log.error(
+                    f"Error occurred when cURLing part: {err}",
+                    destination=dest_file_full,
                 )
-                # Execute the cURL command and examine results
-                _stdin, stdout, stderr = remote_client.exec_command(curl_cmd)
-                results = []
-                out = stdout.readlines()
-                err = stderr.readlines()
-                if err:
-                    log.error(
-                        f"Error occurred when cURLing part: {err}",
-                        destination=dest_file_full,
-                    )
-                    raise TransferPartException
-                if out:
-                    try:
-                        results = out[0].split(",")
-                        status_code = results[0]
-                        if int(status_code) >= 400:
-                            log.error(
-                                f"Error occurred when cURLing part with status code: {status_code}",
-                                destination=dest_file_full,
-                            )
-                            raise TransferPartException
-                        log.info(
-                            "Successfully cURLed part",
-                            destination=dest_file_full,
-                            results=results,
-                        )
-                    except IndexError as i_e:
-                        log.error(
-                            f"Error occurred cURLing part: {i_e}",
-                            destination=dest_file_full,
-                        )
-                        raise TransferPartException
-            except SSHException as ssh_e:
-                log.error(
-                    f"SSH Error occurred when cURLing part: {ssh_e}",
+                raise TransferPartException
+            if not results:
+                self.log.error(
+                    "Error occurred cURLing part: no write-out in output",
+                    destination=dest_file_full,
+                )
+                raise TransferPartException
+            status_code = results[0]
+            if status_code >= 400:
+                self.log.error(
+                    f"Error occurred when cURLing part with status code: {status_code}",
                     destination=dest_file_full,
                 )
+                if status_code < 500 and status_code not in RETRYABLE_CLIENT_ERRORS:
+                    raise TransferPartPermanentException(
+                        f"Part can't be transferred, status code: {status_code}"
+                    )
                 raise TransferPartException
+            self.log.info(
+                "Successfully cURLed part",
+                destination=dest_file_full,
+                results=results,
+            )
+        except SSHException as ssh_e:
+            self.log.error(
+                f"SSH Error occurred when cURLing part: {ssh_e}",
+                destination=dest_file_full,
+            )
+            raise TransferPartException
+
+    def _fetch_size_http(self) -> int:
+        """Fetch the size of the file via HTTP(s).
+
+        The size is in the "content-length" response header.
+
+        Raises:
+            TransferException: If there is no "content-length", e.g. a 404.
+        """
+        size_in_bytes = http_session.head(
+            self.source_url,
+            allow_redirects=True,
+            headers={"host": self.domain, "Accept-Encoding": "identity"},
+        ).headers.get("content-length", None)
+
+        if not size_in_bytes:
+            self.log.error(
+                "Failed to get size of file on Castor", source_url=self.source_url
+            )
+            raise TransferException
+        return size_in_bytes
+
+    def _fetch_size_ftp(self) -> int:
+        """Fetch the size of the file via FTP.
+
+        Open a FTP connection to retrieve the size of the file.
+
+        Raises:
+            TransferException: If the FTP host or file can't be reached.
+        """
+        try:
+            with FTP(host=self.source_url_parsed.netloc, encoding="utf-8") as ftp:
+                ftp.login(
+                    user=self.source_username,
+                    passwd=self.source_password,
+                )
+                return ftp.size(self.source_url_parsed.path)
+        except (gaierror, error_perm) as e:
+            raise TransferException(f"Failed to get size of file on the FTP: {e}")
+
+    # Name of the method to fetch the size of the file per protocol of the source URL
+    _fetch_size_methods = {
+        "http": "_fetch_size_http",
+        "https": "_fetch_size_http",
+        "ftp": "_fetch_size_ftp",
+    }
 
     def _fetch_size(self) -> int:
         """Fetch the size of the file on Castor.
@@ -301,33 +604,10 @@ class Transfer:
                 e.g. a 404.
             ValueError: If the source url contains an unknown protocol.
         """
-
-        source_url_parsed = urlparse(self.source_url)
-        if source_url_parsed.scheme in ("http", "https"):
-            size_in_bytes = requests.head(
-                self.source_url,
-                allow_redirects=True,
-                headers={"host": self.domain, "Accept-Encoding": "identity"},
-            ).headers.get("content-length", None)
-
-            if not size_in_bytes:
-                log.error(
-                    "Failed to get size of file on Castor", source_url=self.source_url
-                )
-                raise TransferException
-        elif source_url_parsed.scheme in ("ftp",):
-            try:
-                with FTP(host=source_url_parsed.netloc, encoding="utf-8") as ftp:
-                    ftp.login(
-                        user=self.source_username,
-                        passwd=self.source_password,
-                    )
-                    size_in_bytes = ftp.size(source_url_parsed.path)
-            except (gaierror, error_perm) as e:
-                raise TransferException(f"Failed to get size of file on the FTP: {e}")
-        else:
+        method_name = self._fetch_size_methods.get(self.source_url_parsed.scheme)
+        if not method_name:
             raise ValueError(f"Protocol not supported: {self.source_url}")
-        return size_in_bytes
+        return getattr(self, method_name)()
 
     def _check_target_folder(self):
         """Check if target folder exists.
@@ -358,29 +638,60 @@ class Transfer:
 
         # If percentage limit is not filled in, skip the check.
         if percentage_limit:
-            while True:
-                # Check the used space in percentage
-                _stdin, stdout, _stderr = self.remote_client.exec_command(
-                    f"df --output=pcent {self.dest_folder_dirname} | tail -1"
-                )
-                out = stdout.readlines()
-                # Parse the used percentage as an int.
-                try:
-                    percentage_used = int(
-                        out[0].strip().split("%")[0]  # Output example: [' 12%\n']
-                    )
-                except ValueError:
-                    log.warning("Could not get used percentage")
-                    break
+            # One remote loop outputs the used space in percentage periodically
+            _stdin, stdout, _stderr = self.remote_client.exec_command(
+                build_free_space_command(self.dest_folder_dirname)
+            )
+            try:
+                for line in stdout:
+                    # Parse the used percentage as an int.
+                    try:
+                        percentage_used = int(
+                            line.strip().split("%")[0]  # Output example: ' 12%\n'
+                        )
+                    except ValueError:
+                        self.log.warning("Could not get used percentage")
+                        break
 
-                free_percentage = 100 - percentage_used
-                log.info(
-                    f"Free space: {free_percentage}%. Space needed: {percentage_limit}%"
-                )
-                if free_percentage > percentage_limit:
-                    break
+                    free_percentage = 100 - percentage_used
+                    self.log.info(
+                        f"Free space: {free_percentage}%. Space needed: {percentage_limit}%"
+                    )
+                    if free_percentage > percentage_limit:
+                        break
                 else:
-                    time.sleep(120)
+                    # The remote loop stopped without output
+                    self.log.warning("Could not get used percentage")
+            finally:
+                # Closing the channel makes the remote loop exit
+                stdout.channel.close()
+
+    def _find_transferred_parts(self) -> Set[int]:
+        """Find the parts in the tmp folder that are completely transferred.
+
+        A part is completely transferred if it was written by this transfer, in an
+        earlier try, and its size is the size of its range. Parts left behind by
+        another transfer to the same destination, e.g. of another version of the
+        source, are never reused.
+
+        Returns:
+            The indexes of the parts that are completely transferred.
+        """
+        part_sizes = {
+            attrs.filename: attrs.st_size
+            for attrs in self.sftp.listdir_attr(self.dest_folder_tmp_dirname)
+        }
+        transferred_parts = set()
+        parts = calculate_ranges(int(self.size_in_bytes), self.number_parts)
+        for idx, part in enumerate(parts):
+            if (idx, part) not in self.written_parts:
+                continue
+            part_filename = calculate_filename_part(self.dest_file_basename, idx)
+            if part_sizes.get(part_filename) == calculate_part_size(
+                part, int(self.size_in_bytes)
+            ):
+                transferred_parts.add(idx)
+        return transferred_parts
 
     def _prepare_target_transfer(self):
         """Prepare for transferring the file to the remote server.
@@ -388,7 +699,9 @@ class Transfer:
         Do the following:
         - Check if the file does not exist yet.
         - Create the tmp folder if it does not exist yet. Note that if the tmp folder
-          already exists, we'll just continue.
+          already exists, we'll just continue. The parts in it that this transfer
+          already completely transferred will not be transferred again. Other
+          parts are overwritten.
 
         Raises:
             OSError:
@@ -397,7 +710,7 @@ class Transfer:
             TransferException: When a SSH error occurred.
         """
         # Check if file doesn't exist yet and make the tmp dir
-
+        self.transferred_parts = set()
         try:
             # Check if the file does not exist yet
             try:
@@ -407,7 +720,7 @@ class Transfer:
                 pass
             else:
                 # If the file exists stop.
-                log.error("File already exists", destination=self.destination_path)
+                self.log.error("File already exists")
                 raise OSError
 
             # Create tmp folder if it doesn't exist yet
@@ -418,13 +731,15 @@ class Transfer:
                 try:
                     self.sftp.stat(self.dest_folder_tmp_dirname)
                 except FileNotFoundError:
-                    log.error(
+                    self.log.error(
                         f"Error occurred when creating tmp folder: {os_e}",
                         tmp_folder=self.dest_folder_tmp_dirname,
                     )
                     raise os_e
+                # Resume: keep the parts that are already transferred
+                self.transferred_parts = self._find_transferred_parts()
         except SSHException as ssh_e:
-            log.error(
+            self.log.error(
                 f"SSH Error occurred: {ssh_e}",
                 tmp_folder=self.dest_folder_tmp_dirname,
             )
@@ -434,29 +749,46 @@ class Transfer:
         """Transfer the file in separate parts.
 
         Split up a file in a certain amount of parts. Transfer each part simultaneously
-        in a separate thread. Wait for the threads to finish, thus wait for all the
-        parts to finish transferring.
-        """
-        parts = calculate_ranges(int(self.size_in_bytes), NUMBER_PARTS)
-        threads = []
-        for idx, part in enumerate(parts):
-            dest_file_part_full = calculate_filename_part(
-                self.dest_file_basename, idx, directory=self.dest_folder_tmp_dirname
-            )
-            thread = threading.Thread(
-                target=self._transfer_part,
-                args=(
-                    dest_file_part_full,
-                    part,
-                ),
-            )
-            threads.append(thread)
-            thread.start()
-            log.debug(f"Thread started for: {dest_file_part_full}")
+        in a separate thread, each in its own channel of the SSH connection. Wait for
+        the threads to finish, thus wait for all the parts to finish transferring.
 
-        # Wait for the parts to finish transferring
-        for thread in threads:
-            thread.join()
+        As soon as a part fails, the parts that haven't started yet are cancelled.
+
+        Raises:
+            TransferException: If a part failed to transfer. The parts that are
+                completely transferred are kept, so a retry resumes the transfer.
+            TransferPartPermanentException: If a part can't be transferred.
+        """
+        parts = calculate_ranges(int(self.size_in_bytes), self.number_parts)
+        # Stay within the sessions the remote server allows per connection,
+        # leaving room for the SFTP channel.
+        max_workers = min(len(parts), MAX_SESSIONS - 2)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            for idx, part in enumerate(parts):
+                dest_file_part_full = calculate_filename_part(
+                    self.dest_file_basename, idx, directory=self.dest_folder_tmp_dirname
+                )
+                if idx in self.transferred_parts:
+                    self.log.debug(f"Part already transferred: {dest_file_part_full}")
+                    continue
+                future = executor.submit(self._transfer_part, dest_file_part_full, part)
+                futures[future] = (idx, part)
+                self.log.debug(f"Part submitted: {dest_file_part_full}")
+            try:
+                for future in as_completed(futures):
+                    future.result()
+                    self.written_parts.add(futures[future])
+            except TransferPartException:
+                # Don't start the parts that are still waiting
+                for pending in futures:
+                    pending.cancel()
+                self.log.error("Error occurred when transferring the parts")
+                raise TransferException
+            except Exception:
+                for pending in futures:
+                    pending.cancel()
+                raise
 
     def _assemble_parts(self):
         """Assemble the parts into the destination file.
@@ -465,75 +797,64 @@ class Transfer:
         If the size of the assembled file is correct, the tmp file will be renamed
         as the destination file in the correct folder.
 
-        The parts and the tmp folder will be removed.
+        The parts and the tmp folder will be removed. All these steps are chained
+        in one remote command.
 
         Raises:
             TransferException: If an OSError occurs.
         """
-        log.info("Start assembling the parts", destination=self.destination_path)
+        self.log.info("Start assembling the parts")
         try:
-            _stdin, stdout, stderr = self.remote_client.exec_command(
-                build_assemble_command(
-                    self.dest_folder_tmp_dirname,
-                    self.dest_file_basename,
-                    NUMBER_PARTS,
-                )
-            )
-            # This waits for assembling to finish?
-            _ = stdout.readlines()
-            _ = stderr.readlines()
-
             self.dest_file_tmp_filename = os.path.join(
                 self.dest_folder_tmp_dirname, self.dest_file_tmp_basename
             )
 
-            # Check if file has the correct size
-            file_attrs = self.sftp.stat(self.dest_file_tmp_filename)
-            if file_attrs.st_size != int(self.size_in_bytes):
-                log.error(
-                    f"Size of assembled file: {file_attrs.st_size}, expected size: {self.size_in_bytes}",
+            assemble_command = build_assemble_command(
+                self.dest_folder_tmp_dirname,
+                self.dest_file_basename,
+                self.number_parts,
+            )
+            finalize_command = build_finalize_command(
+                self.dest_folder_tmp_dirname,
+                self.dest_file_basename,
+                self.destination_path,
+                self.size_in_bytes,
+            )
+            # Assemble the parts. If the assembled file has the correct size, rename
+            # and move file to destination folder, touch it and delete the parts
+            # and the tmp folder.
+            _stdin, stdout, stderr = self.remote_client.exec_command(
+                f"{assemble_command} && {finalize_command}"
+            )
+            out = stdout.readlines()
+            err = stderr.readlines()
+            try:
+                # Output example: ['1000\n']
+                assembled_size = int(out[0])
+            except (IndexError, ValueError):
+                raise OSError(f"Could not get size of assembled file: {err}")
+            if assembled_size != int(self.size_in_bytes):
+                self.log.error(
+                    f"Size of assembled file: {assembled_size}, expected size: {self.size_in_bytes}",
                     source_url=self.source_url,
                     destination_filename=self.dest_file_tmp_filename,
                 )
                 raise TransferException
-            # Rename and move file destination folder
-            self.sftp.rename(
-                self.dest_file_tmp_filename,
-                self.destination_path,
-            )
-            # Touch the file so MH picks it up
-            # Explicitly use a `SSH touch` as `SFTP utime` doesn't work
-            self.remote_client.exec_command(f"touch '{self.destination_path}'")
-
-            # Delete the parts
-            for idx in range(NUMBER_PARTS):
-                try:
-                    self.sftp.remove(
-                        calculate_filename_part(
-                            self.dest_file_basename,
-                            idx,
-                            directory=self.dest_folder_tmp_dirname,
-                        )
-                    )
-                except FileNotFoundError:
-                    # Only delete parts that exist
-                    pass
-            # Delete the tmp folder
-            self.sftp.rmdir(self.dest_folder_tmp_dirname)
-            log.info("File successfully transferred", destination=self.destination_path)
+            if stdout.channel.recv_exit_status():
+                raise OSError(f"Could not finalize assembled file: {err}")
+            self.log.info("File successfully transferred")
         except OSError as os_e:
-            log.error(
-                f"Error occurred when assembling parts: {os_e}",
-                destination=self.destination_path,
-            )
+            self.log.error(f"Error occurred when assembling parts: {os_e}")
             raise TransferException
 
-    @retry(TransferException, tries=3, delay=3, logger=log)
+    @retry(TransferException, tries=3, delay=3, backoff=2, jitter=(0, 1), logger=log)
     def transfer(self):
         """Transfer a file to a remote server.
 
-        First we'll make the tmp dir to transfer the parts to.
-        Then, fetch the size of the file to determine how to split it up in parts.
+        The size of the file is fetched in the background while connecting to
+        the remote server and checking its target folder and free space.
+        Then we'll make the tmp dir to transfer the parts to.
+        The size of the file determines how to split it up in parts.
         Split up in parts and each part will be separately transferred in its own Thread.
         When the threads are done, assemble the file.
 
@@ -542,32 +863,34 @@ class Transfer:
         """
 
         try:
-            log.info(f"Start transferring of file: {self.source_url}")
+            self.log.info(f"Start transferring of file: {self.source_url}")
+
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                # Fetch size of the file to transfer, independent of the remote
+                # server, in the background while setting up the remote server
+                fetch_size_future = executor.submit(self._fetch_size)
+
+                # initialize the SSH client, shared by all the steps
+                self._init_remote_client()
 
-            # initialize the SSH client
-            self._init_remote_client()
+                # Check if target folder exists
+                self._check_target_folder()
 
-            # Check if target folder exists
-            self._check_target_folder()
+                # Check freespace
+                self._check_free_space()
 
-            # Check freespace
-            self._check_free_space()
+                self.size_in_bytes = fetch_size_future.result()
 
-            # Fetch size of the file to transfer
-            self.size_in_bytes = self._fetch_size()
+            # Small files are split up in less parts
+            self.number_parts = calculate_number_parts(int(self.size_in_bytes))
 
             # Check if file doesn't exist yet and make the tmp dir
             self._prepare_target_transfer()
-        finally:
-            self.remote_client.close()
 
-        # Transfer the parts
-        self._transfer_parts()
+            # Transfer the parts
+            self._transfer_parts()
 
-        try:
-            # Re-initialize the SSH client
-            self._init_remote_client()
             # Assemble the parts
             self._assemble_parts()
         finally:
-            self.remote_client.close()
+            self._close_remote_client()
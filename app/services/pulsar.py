@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import threading
+
 import pulsar
 
 from viaa.configuration import ConfigParser
@@ -15,21 +17,31 @@ class PulsarClient:
             f'pulsar://{self.pulsar_config["host"]}:{self.pulsar_config["port"]}'
         )
         self.producers = {}
+        # Guards creating the producers, as the transfer threads share the client
+        self.producers_lock = threading.Lock()
 
     def produce_event(self, topic: str, event: Event):
         """Produce a cloudevent on a topic
 
         If there is no producer yet for the given topic, a new one will be created.
+        Only one producer is created per topic, even if multiple threads produce
+        their first event on that topic at the same time.
 
         Args:
             topic: The topic to send the cloudevent to.
             event: The cloudevent to send to the topic.
         """
-        if topic not in self.producers:
-            self.producers[topic] = self.client.create_producer(topic)
+        producer = self.producers.get(topic)
+        if producer is None:
+            with self.producers_lock:
+                # Check again, another thread could have created it meanwhile
+                producer = self.producers.get(topic)
+                if producer is None:
+                    producer = self.client.create_producer(topic)
+                    self.producers[topic] = producer
 
         msg = PulsarBinding.to_protocol(event, CEMessageMode.STRUCTURED)
-        self.producers[topic].send(
+        producer.send(
             msg.data,
             properties=msg.attributes,
             event_timestamp=event.get_event_time_as_int(),
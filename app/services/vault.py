@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import time
+
 import hvac
 from viaa.configuration import ConfigParser
 
@@ -10,7 +12,13 @@ config = config_parser.app_cfg
 
 
 class VaultClient:
-    def __init__(self):
+    def __init__(self, secret_ttl: int = 300):
+        """Initialize a VaultClient.
+
+        Args:
+            secret_ttl: The time in seconds a fetched secret is cached, so a
+                rotated secret is picked up after at most this time.
+        """
         self.client = hvac.Client(
             url=config["vault"]["url"],
             token=config["vault"]["token"],
@@ -18,23 +26,42 @@ class VaultClient:
             verify=False,
         )
 
+        self.secret_ttl = secret_ttl
         self.secrets = {}
+        # Monotonic time of when each secret was fetched
+        self.fetched_at = {}
 
     def fetch_secret(self, path: str):
         """Fetch the secret from Vault for a given path.
 
-        After fetching the secret, it will be cached.
+        After fetching the secret, it will be cached for the TTL of the secrets.
 
         Args:
             path: The path of the secret in format "{secret_engine}/{secret_name}".
         """
-        self.mount_point = path.split("/")[0]
-        self.path = path.split("/")[1]
-
-        if path not in self.secrets:
+        fetched_at = self.fetched_at.get(path)
+        if (
+            path not in self.secrets
+            or fetched_at is None
+            or time.monotonic() - fetched_at > self.secret_ttl
+        ):
+            # Local names as the client is shared by the transfer threads
+            mount_point, secret_path = path.split("/")[:2]
             self.secrets[path] = self.client.secrets.kv.v2.read_secret(
-                path=self.path, mount_point=self.mount_point
+                path=secret_path, mount_point=mount_point
             )["data"]
+            self.fetched_at[path] = time.monotonic()
+
+    def invalidate(self, path: str):
+        """Remove the secret from the cache, e.g. when it's known to be rotated.
+
+        The next fetch of the secret will read it from Vault again.
+
+        Args:
+            path: The path of the secret in format "{secret_engine}/{secret_name}".
+        """
+        self.secrets.pop(path, None)
+        self.fetched_at.pop(path, None)
 
     def get_username(self, path: str) -> str:
         try:
@@ -12,6 +12,9 @@ def disable_network_calls(monkeypatch):
         raise RuntimeError("Network access not allowed during testing!")
 
     monkeypatch.setattr(requests, "head", lambda *args, **kwargs: stunted_head())
+    monkeypatch.setattr(
+        requests.Session, "head", lambda *args, **kwargs: stunted_head()
+    )
     monkeypatch.setattr(
         paramiko.SSHClient, "connect", lambda *args, **kwargs: stunted_ssh_connect()
     )
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import pytest
+from unittest.mock import MagicMock, patch
+
+from paramiko import SSHException
+
+from app.helpers.ssh_pool import SSHPool
+
+
+class TestSSHPool:
+    @pytest.fixture()
+    def pool(self) -> SSHPool:
+        return SSHPool(keepalive_interval=10)
+
+    @patch("app.helpers.ssh_pool.SSHClient")
+    def test_acquire(self, ssh_client_mock, pool):
+        """No idle connection, so a new one is made."""
+        client = pool.acquire("host", 22, "user", "pass")
+
+        assert client == ssh_client_mock()
+        client.set_missing_host_key_policy.assert_called_once()
+        client.connect.assert_called_once_with(
+            "host", port=22, username="user", password="pass"
+        )
+        client.get_transport().set_keepalive.assert_called_once_with(10)
+        assert pool.client_keys[client] == ("host", 22, "user")
+
+    @patch("app.helpers.ssh_pool.SSHClient")
+    def test_acquire_connect_error(self, ssh_client_mock, pool):
+        """A client that fails to connect is closed and not handed out."""
+        client = ssh_client_mock()
+        client.connect.side_effect = SSHException("Authentication failed.")
+
+        with pytest.raises(SSHException):
+            pool.acquire("host", 22, "user", "pass")
+
+        client.close.assert_called_once()
+        assert client not in pool.client_keys
+
+    def test_acquire_idle(self, pool):
+        """An active idle connection is reused."""
+        client = MagicMock()
+        client.get_transport().is_active.return_value = True
+        pool.idle_clients[("host", 22, "user")].append(client)
+
+        assert pool.acquire("host", 22, "user", "pass") == client
+        client.connect.assert_not_called()
+        assert not pool.idle_clients[("host", 22, "user")]
+
+    @patch("app.helpers.ssh_pool.SSHClient")
+    def test_acquire_idle_inactive(self, ssh_client_mock, pool):
+        """An idle connection that isn't active anymore is closed."""
+        idle_client = MagicMock()
+        idle_client.get_transport().is_active.return_value = False
+        pool.idle_clients[("host", 22, "user")].append(idle_client)
+
+        client = pool.acquire("host", 22, "user", "pass")
+
+        idle_client.close.assert_called_once()
+        assert client == ssh_client_mock()
+        client.connect.assert_called_once()
+
+    @patch("app.helpers.ssh_pool.SSHClient")
+    def test_acquire_no_reuse(self, ssh_client_mock, pool):
+        """A new connection is made, even if there is an active idle one."""
+        idle_client = MagicMock()
+        idle_client.get_transport().is_active.return_value = True
+        pool.idle_clients[("host", 22, "user")].append(idle_client)
+
+        client = pool.acquire("host", 22, "user", "pass", reuse=False)
+
+        assert client == ssh_client_mock()
+        client.connect.assert_called_once()
+        assert list(pool.idle_clients[("host", 22, "user")]) == [idle_client]
+
+    @patch("app.helpers.ssh_pool.SSHClient")
+    def test_acquire_other_key(self, ssh_client_mock, pool):
+        """Idle connections of another user are not reused."""
+        idle_client = MagicMock()
+        pool.idle_clients[("host", 22, "other")].append(idle_client)
+
+        client = pool.acquire("host", 22, "user", "pass")
+
+        assert client == ssh_client_mock()
+        assert list(pool.idle_clients[("host", 22, "other")]) == [idle_client]
+
+    @patch("app.helpers.ssh_pool.SSHClient")
+    def test_release(self, ssh_client_mock, pool):
+        client = pool.acquire("host", 22, "user", "pass")
+        client.get_transport().is_active.return_value = True
+
+        pool.release(client)
+
+        client.close.assert_not_called()
+        assert client not in pool.client_keys
+        assert pool.acquire("host", 22, "user", "pass") == client
+
+    @patch("app.helpers.ssh_pool.SSHClient")
+    def test_release_inactive(self, ssh_client_mock, pool):
+        client = pool.acquire("host", 22, "user", "pass")
+        client.get_transport().is_active.return_value = False
+
+        pool.release(client)
+
+        client.close.assert_called_once()
+        assert not pool.idle_clients[("host", 22, "user")]
+
+    @patch("app.helpers.ssh_pool.SSHClient")
+    def test_discard(self, ssh_client_mock, pool):
+        client = pool.acquire("host", 22, "user", "pass")
+
+        pool.discard(client)
+
+        client.close.assert_called_once()
+        assert client not in pool.client_keys
+        assert not pool.idle_clients[("host", 22, "user")]
+
+    def test_close(self, pool):
+        client_1, client_2 = MagicMock(), MagicMock()
+        pool.idle_clients[("host", 22, "user")].append(client_1)
+        pool.idle_clients[("other", 22, "user")].append(client_2)
+
+        pool.close()
+
+        client_1.close.assert_called_once()
+        client_2.close.assert_called_once()
+        assert not pool.idle_clients[("host", 22, "user")]
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import logging
+import os
 import pytest
+import subprocess
 from ftplib import error_perm
 from socket import gaierror
 from unittest.mock import MagicMock, patch
@@ -9,13 +12,21 @@ from urllib.parse import urlparse
 from hvac.exceptions import InvalidPath, Forbidden
 from paramiko import SSHException
 
+from app.helpers.ssh_pool import SSHPool
 from app.helpers.transfer import (
     build_curl_command,
+    build_finalize_command,
+    build_free_space_command,
     calculate_filename_part,
+    calculate_number_parts,
+    calculate_part_size,
     calculate_ranges,
+    http_session,
+    parse_curl_write_out,
     Transfer,
     TransferException,
     TransferPartException,
+    TransferPartPermanentException,
 )
 
 
@@ -44,6 +55,20 @@ def test_calculate_ranges_error(size, number_parts, side_effect, message):
     assert str(e.value) == message
 
 
+@pytest.mark.parametrize(
+    "size, expected",
+    [
+        (1000, 1),
+        (64 * 1024 * 1024, 1),
+        (64 * 1024 * 1024 + 1, 2),
+        (200 * 1024 * 1024, 4),
+        (100 * 1024 * 1024 * 1024, 4),
+    ],
+)
+def test_calculate_number_parts(size, expected):
+    assert calculate_number_parts(size) == expected
+
+
 def test_build_curl_command():
     dest = "dest file"
     src = "source file"
@@ -74,6 +99,145 @@ def test_build_curl_command_credentials():
     )
 
 
+@pytest.mark.parametrize("r", ["100-", "-100", "100-0", "0-100,200-300", ""])
+def test_build_curl_command_range_not_closed(r):
+    with pytest.raises(ValueError) as e:
+        build_curl_command("dest file", "source file", "S3 domain", r)
+    assert str(e.value) == f"Range is not closed: '{r}'"
+
+
+def test_build_finalize_command():
+    finalize_command = build_finalize_command(
+        "/dir/file.mxf.part", "file.mxf", "/dir/file.mxf", 1000
+    )
+    assert finalize_command == (
+        'size=$(stat -c %s /dir/file.mxf.part/file.mxf.tmp) && echo "$size"'
+        ' && test "$size" -eq 1000'
+        " && { ln /dir/file.mxf.part/file.mxf.tmp /dir/file.mxf"
+        " || { [ ! -e /dir/file.mxf ]"
+        " && mv /dir/file.mxf.part/file.mxf.tmp /dir/file.mxf; }; }"
+        " && rm -f /dir/file.mxf.part/file.mxf.tmp"
+        " && touch /dir/file.mxf"
+        " && rm -rf /dir/file.mxf.part"
+    )
+
+
+def test_build_finalize_command_not_tmp_folder():
+    with pytest.raises(ValueError) as e:
+        build_finalize_command("/dir", "file.mxf", "/dir/file.mxf", 1000)
+    assert str(e.value) == "Not a tmp folder: '/dir'"
+
+
+def test_build_finalize_command_destination_exists(tmp_path):
+    """The finalize command doesn't overwrite an existing destination."""
+    tmp_folder = tmp_path / "file.mxf.part"
+    tmp_folder.mkdir()
+    (tmp_folder / "file.mxf.tmp").write_bytes(b"new")
+    destination = tmp_path / "file.mxf"
+    destination.write_bytes(b"old")
+
+    finalize_command = build_finalize_command(
+        str(tmp_folder), "file.mxf", str(destination), 3
+    )
+    result = subprocess.run(
+        ["sh", "-c", finalize_command], capture_output=True, text=True
+    )
+
+    assert result.returncode != 0
+    assert result.stdout == "3\n"
+    assert destination.read_bytes() == b"old"
+    assert (tmp_folder / "file.mxf.tmp").exists()
+
+
+def test_build_finalize_command_no_hard_links(tmp_path):
+    """The tmp file is renamed on a filesystem without hard links."""
+    bin_folder = tmp_path / "bin"
+    bin_folder.mkdir()
+    ln = bin_folder / "ln"
+    ln.write_text("#!/bin/sh\necho 'ln: Operation not permitted' >&2\nexit 1\n")
+    ln.chmod(0o755)
+    tmp_folder = tmp_path / "file.mxf.part"
+    tmp_folder.mkdir()
+    (tmp_folder / "file.mxf.tmp").write_bytes(b"new")
+    destination = tmp_path / "file.mxf"
+
+    finalize_command = build_finalize_command(
+        str(tmp_folder), "file.mxf", str(destination), 3
+    )
+    result = subprocess.run(
+        ["sh", "-c", finalize_command],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PATH": f"{bin_folder}:{os.environ['PATH']}"},
+    )
+
+    assert result.returncode == 0
+    assert destination.read_bytes() == b"new"
+    assert not tmp_folder.exists()
+
+
+def test_build_finalize_command_no_hard_links_destination_exists(tmp_path):
+    """Renaming the tmp file doesn't overwrite an existing destination either."""
+    bin_folder = tmp_path / "bin"
+    bin_folder.mkdir()
+    ln = bin_folder / "ln"
+    ln.write_text("#!/bin/sh\necho 'ln: Operation not permitted' >&2\nexit 1\n")
+    ln.chmod(0o755)
+    tmp_folder = tmp_path / "file.mxf.part"
+    tmp_folder.mkdir()
+    (tmp_folder / "file.mxf.tmp").write_bytes(b"new")
+    destination = tmp_path / "file.mxf"
+    destination.write_bytes(b"old")
+
+    finalize_command = build_finalize_command(
+        str(tmp_folder), "file.mxf", str(destination), 3
+    )
+    result = subprocess.run(
+        ["sh", "-c", finalize_command],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PATH": f"{bin_folder}:{os.environ['PATH']}"},
+    )
+
+    assert result.returncode != 0
+    assert destination.read_bytes() == b"old"
+    assert (tmp_folder / "file.mxf.tmp").exists()
+
+
+def test_build_free_space_command():
+    assert build_free_space_command("/dir name", interval=60) == (
+        "while out=$(df --output=pcent '/dir name' | tail -1)"
+        ' && [ -n "$out" ] && echo "$out"; do sleep 60; done'
+    )
+
+
+def test_parse_curl_write_out():
+    assert parse_curl_write_out("206,time: 5s,size: 1000 bytes,speed: 200b/s") == (
+        206,
+        5.0,
+        1000,
+        200.0,
+    )
+
+
+def test_parse_curl_write_out_decimals():
+    assert parse_curl_write_out(
+        "200,time: 0.123456s,size: 1000 bytes,speed: 8100.500b/s"
+    ) == (200, 0.123456, 1000, 8100.5)
+
+
+def test_parse_curl_write_out_no_match():
+    assert parse_curl_write_out("curl: (6) Could not resolve host") is None
+
+
+@pytest.mark.parametrize(
+    "part_range, expected",
+    [("0-326", 327), ("327-652", 326), ("653-977", 325), ("978-1303", 325)],
+)
+def test_calculate_part_size(part_range, expected):
+    assert calculate_part_size(part_range, 1303) == expected
+
+
 def test_calculate_filename_part():
     assert calculate_filename_part("file.mxf", 0) == "file.mxf.part0"
 
@@ -84,6 +248,10 @@ def test_calculate_filename_part_directory():
     )
 
 
+def test_paramiko_log_level():
+    assert logging.getLogger("paramiko").level == logging.WARNING
+
+
 class TestTransfer:
     @pytest.fixture()
     def transfer_message(self) -> dict:
@@ -100,8 +268,15 @@ class TestTransfer:
             "outcome": {"pulsar-topic": "topic"},
         }
 
+    @pytest.fixture(autouse=True)
+    def pool(self, monkeypatch) -> SSHPool:
+        """Use an empty SSH pool per test."""
+        pool = SSHPool()
+        monkeypatch.setattr("app.helpers.transfer.ssh_pool", pool)
+        return pool
+
     @pytest.fixture()
-    @patch("app.helpers.transfer.SSHClient")
+    @patch("app.helpers.ssh_pool.SSHClient")
     def transfer(self, ssh_client_mock, transfer_message) -> Transfer:
         vault_mock = MagicMock()
         vault_mock.get_username.return_value = "ssh_user"
@@ -118,32 +293,24 @@ class TestTransfer:
             Transfer(transfer_message, vault_mock)
 
     @patch("app.helpers.transfer.build_curl_command", return_value="curl")
-    @patch("app.helpers.transfer.SSHClient")
-    def test_transfer_part(
-        self, ssh_client_mock, build_curl_command_mock, transfer, caplog
-    ):
+    def test_transfer_part(self, build_curl_command_mock, transfer, caplog):
         """Successful transfer of a part."""
         stdin_mock, stdout_mock, stderr_mock = (MagicMock(), MagicMock(), MagicMock())
         # Mock the stdout result of the cURL command
         stdout_result = ["206,time: 5s,size: 1000 bytes,speed: 200b/s"]
-        stdout_mock.readlines.return_value = stdout_result
+        stdout_mock.__iter__.side_effect = lambda: iter(stdout_result)
         # Mock stderr to be empty
         stderr_mock.readlines.return_value = []
 
         # Mock exec command
-        client_mock = ssh_client_mock().__enter__()
+        client_mock = transfer.remote_client
         client_mock.exec_command.return_value = (stdin_mock, stdout_mock, stderr_mock)
 
         transfer._transfer_part("dest", "0-100")
 
+        # The SSH connection of the transfer is reused
         assert client_mock.set_missing_host_key_policy.call_count == 1
         assert client_mock.connect.call_count == 1
-        assert client_mock.connect.call_args.args == ("tst-server",)
-        assert client_mock.connect.call_args.kwargs == {
-            "port": 22,
-            "username": "ssh_user",
-            "password": "ssh_pass",
-        }
 
         # Check if curl command gets called with the correct arguments
         build_curl_command_mock.assert_called_once_with(
@@ -155,42 +322,63 @@ class TestTransfer:
             source_password=transfer.source_password,
         )
 
-        assert client_mock.exec_command() == (stdin_mock, stdout_mock, stderr_mock)
+        client_mock.exec_command.assert_called_once_with("curl")
         assert "Successfully cURLed part" in caplog.messages
 
-    @patch("app.helpers.transfer.SSHClient")
     @patch("time.sleep", MagicMock())
-    def test_transfer_part_status_code(self, ssh_client_mock, transfer, caplog):
-        """HTTP error occurs when transferring a part."""
+    def test_transfer_part_status_code(self, transfer, caplog):
+        """HTTP client error occurs when transferring a part, which isn't retried."""
         stdin_mock, stdout_mock, stderr_mock = (MagicMock(), MagicMock(), MagicMock())
         # Mock the stdout result of the cURL command
         stdout_result = ["416,time: 5s,size: 1000 bytes,speed: 200b/s"]
-        stdout_mock.readlines.return_value = stdout_result
+        stdout_mock.__iter__.side_effect = lambda: iter(stdout_result)
         # Mock stderr to be empty
         stderr_mock.readlines.return_value = []
 
         # Mock exec command
-        client_mock = ssh_client_mock().__enter__()
+        client_mock = transfer.remote_client
         client_mock.exec_command.return_value = (stdin_mock, stdout_mock, stderr_mock)
-        with pytest.raises(TransferPartException):
+        with pytest.raises(TransferPartPermanentException):
             transfer._transfer_part("dest", "0-100")
 
-        assert client_mock.set_missing_host_key_policy.call_count == 3
-        assert client_mock.connect.call_count == 3
-        assert client_mock.connect.call_args.args == ("tst-server",)
-        assert client_mock.connect.call_args.kwargs == {
-            "port": 22,
-            "username": "ssh_user",
-            "password": "ssh_pass",
-        }
-        assert client_mock.exec_command() == (stdin_mock, stdout_mock, stderr_mock)
+        assert client_mock.exec_command.call_count == 1
+        assert client_mock.connect.call_count == 1
         assert (
             "Error occurred when cURLing part with status code: 416" in caplog.messages
         )
 
-    @patch("app.helpers.transfer.SSHClient")
+    @pytest.mark.parametrize("status_code", [429, 503])
+    @patch("time.sleep")
+    def test_transfer_part_status_code_retry(
+        self, sleep_mock, status_code, transfer, caplog
+    ):
+        """HTTP error occurs when transferring a part, which is retried with backoff."""
+        stdin_mock, stdout_mock, stderr_mock = (MagicMock(), MagicMock(), MagicMock())
+        # Mock the stdout result of the cURL command
+        stdout_result = [f"{status_code},time: 5s,size: 1000 bytes,speed: 200b/s"]
+        stdout_mock.__iter__.side_effect = lambda: iter(stdout_result)
+        # Mock stderr to be empty
+        stderr_mock.readlines.return_value = []
+
+        # Mock exec command
+        client_mock = transfer.remote_client
+        client_mock.exec_command.return_value = (stdin_mock, stdout_mock, stderr_mock)
+        with pytest.raises(TransferPartException):
+            transfer._transfer_part("dest", "0-100")
+
+        assert client_mock.exec_command.call_count == 3
+        # The delay doubles between the tries, with a jitter added to it
+        delays = [call.args[0] for call in sleep_mock.call_args_list]
+        assert len(delays) == 2
+        assert 3 <= delays[0] <= 4
+        assert 2 * delays[0] <= delays[1] <= 2 * delays[0] + 1
+        assert (
+            f"Error occurred when cURLing part with status code: {status_code}"
+            in caplog.messages
+        )
+
     @patch("time.sleep", MagicMock())
-    def test_transfer_part_stderr(self, ssh_client_mock, transfer, caplog):
+    def test_transfer_part_stderr(self, transfer, caplog):
         """Transferring a part resulting in stderr output."""
         stdin_mock, stdout_mock, stderr_mock = (MagicMock(), MagicMock(), MagicMock())
         # Mock the stderr result of the cURL command
@@ -198,26 +386,105 @@ class TestTransfer:
         stderr_mock.readlines.return_value = stderr_result
 
         # Mock exec command
-        client_mock = ssh_client_mock().__enter__()
+        client_mock = transfer.remote_client
         client_mock.exec_command.return_value = (stdin_mock, stdout_mock, stderr_mock)
         with pytest.raises(TransferPartException):
             transfer._transfer_part("dest", "0-100")
+        assert client_mock.exec_command.call_count == 3
         assert "Error occurred when cURLing part: ['Error']" in caplog.messages
 
-    @patch("app.helpers.transfer.SSHClient")
     @patch("time.sleep", MagicMock())
-    def test_transfer_part_ssh_exception(self, ssh_client_mock, transfer, caplog):
-        """SSH Exception occurs when connecting."""
-        client_mock = ssh_client_mock().__enter__()
-        client_mock.connect.side_effect = SSHException("Connection error")
+    def test_transfer_part_no_write_out(self, transfer, caplog):
+        """Transferring a part without the write-out in the stdout."""
+        stdin_mock, stdout_mock, stderr_mock = (MagicMock(), MagicMock(), MagicMock())
+        stdout_mock.__iter__.side_effect = lambda: iter(["unexpected"])
+        stderr_mock.readlines.return_value = []
+
+        # Mock exec command
+        client_mock = transfer.remote_client
+        client_mock.exec_command.return_value = (stdin_mock, stdout_mock, stderr_mock)
+        with pytest.raises(TransferPartException):
+            transfer._transfer_part("dest", "0-100")
+        assert client_mock.exec_command.call_count == 3
+        assert "Error occurred cURLing part: no write-out in output" in caplog.messages
+
+    @patch("time.sleep", MagicMock())
+    def test_transfer_part_ssh_exception(self, transfer, caplog):
+        """SSH Exception occurs when executing the cURL command."""
+        client_mock = transfer.remote_client
+        client_mock.exec_command.side_effect = SSHException("Connection error")
         with pytest.raises(TransferPartException):
             transfer._transfer_part("dest", "0-100")
-        assert not client_mock.exec_command.call_count
+        assert client_mock.exec_command.call_count == 3
         assert (
             "SSH Error occurred when cURLing part: Connection error" in caplog.messages
         )
 
-    @patch("requests.head")
+    @patch.object(Transfer, "_init_remote_client")
+    def test_ensure_remote_client(self, init_remote_client_mock, transfer):
+        """The SSH connection is still active."""
+        transfer.remote_client.get_transport().is_active.return_value = True
+
+        assert transfer._ensure_remote_client() == transfer.remote_client
+
+        transfer.remote_client.close.assert_not_called()
+        init_remote_client_mock.assert_not_called()
+
+    def test_ensure_remote_client_missing(self, transfer, caplog):
+        """The SSH client has been closed while a part is still transferring."""
+        transfer.remote_client = None
+
+        with pytest.raises(TransferPartException):
+            transfer._ensure_remote_client()
+
+        assert "No SSH client to transfer the part with" in caplog.messages
+
+    @patch("app.helpers.transfer.build_curl_command", return_value="curl")
+    @patch.object(Transfer, "_ensure_remote_client")
+    def test_transfer_part_checked_client(
+        self, ensure_remote_client_mock, build_curl_command_mock, transfer
+    ):
+        """The part is transferred with the SSH client that was checked."""
+        stdin_mock, stdout_mock, stderr_mock = (MagicMock(), MagicMock(), MagicMock())
+        stdout_result = ["206,time: 5s,size: 1000 bytes,speed: 200b/s"]
+        stdout_mock.__iter__.side_effect = lambda: iter(stdout_result)
+        stderr_mock.readlines.return_value = []
+        checked_client = ensure_remote_client_mock.return_value
+        checked_client.exec_command.return_value = (
+            stdin_mock,
+            stdout_mock,
+            stderr_mock,
+        )
+        # Another thread replaced the client of the transfer in the meantime
+        transfer.remote_client = None
+
+        transfer._transfer_part("dest", "0-100")
+
+        checked_client.exec_command.assert_called_once_with("curl")
+
+    @patch.object(Transfer, "_init_remote_client")
+    def test_ensure_remote_client_reconnect(
+        self, init_remote_client_mock, transfer, caplog
+    ):
+        """The SSH connection has been lost."""
+        transfer.remote_client.get_transport().is_active.return_value = False
+
+        transfer._ensure_remote_client()
+
+        transfer.remote_client.close.assert_called_once()
+        init_remote_client_mock.assert_called_once()
+        assert "SSH connection lost, reconnecting" in caplog.messages
+
+    def test_http_session_retry(self):
+        """Transient errors of the source are retried with backoff."""
+        for prefix in ("http://", "https://"):
+            max_retries = http_session.get_adapter(prefix).max_retries
+            assert max_retries.total == 3
+            assert max_retries.backoff_factor == 0.5
+            assert max_retries.status_forcelist == [500, 502, 503, 504]
+            assert not max_retries.raise_on_status
+
+    @patch("app.helpers.transfer.http_session.head")
     def test_fetch_size(self, head_mock, transfer):
         """Response contains a "content-length" response header with the size."""
         # Mock return size of file
@@ -226,7 +493,7 @@ class TestTransfer:
         size = transfer._fetch_size()
         assert size == 1000
 
-    @patch("requests.head")
+    @patch("app.helpers.transfer.http_session.head")
     def test_fetch_size_error(self, head_mock, transfer, caplog):
         """No "content-length" response header."""
         # Mock return size of file
@@ -238,29 +505,51 @@ class TestTransfer:
         assert log_record.message == "Failed to get size of file on Castor"
 
     @patch("app.helpers.transfer.FTP")
-    def test_fetch_size_ftp(self, ftp_mock, transfer):
-        transfer.source_url = transfer.source_url.replace("http", "ftp")
+    def test_fetch_size_ftp(self, ftp_mock, transfer_message):
+        transfer_message["source"]["url"] = "ftp://url/bucket/file.mxf"
+        transfer = Transfer(transfer_message, MagicMock())
         transfer.source_username = "user"
         transfer.source_password = "pass"
         ftp_client = ftp_mock().__enter__()
         ftp_client.size.return_value = 2000
         size = transfer._fetch_size()
 
+        ftp_mock.assert_called_with(host="url", encoding="utf-8")
         ftp_client.login.assert_called_once_with(user="user", passwd="pass")
+        ftp_client.size.assert_called_once_with("/bucket/file.mxf")
         assert size == 2000
 
     @patch("app.helpers.transfer.FTP")
     @pytest.mark.parametrize("error", [gaierror, error_perm])
-    def test_fetch_size_ftp_error(self, ftp_mock, transfer, error):
-        transfer.source_url = transfer.source_url.replace("http", "ftp")
+    def test_fetch_size_ftp_error(self, ftp_mock, transfer_message, error):
+        transfer_message["source"]["url"] = "ftp://url/bucket/file.mxf"
+        transfer = Transfer(transfer_message, MagicMock())
         ftp_mock.side_effect = error
         with pytest.raises(TransferException):
             transfer._fetch_size()
 
-    def test_fetch_size_unknown_protocol(self, transfer):
-        transfer.source_url = transfer.source_url.replace("http", "ldap")
-        with pytest.raises(ValueError):
+    @pytest.mark.parametrize(
+        "url, method",
+        [
+            ("http://url/file.mxf", "_fetch_size_http"),
+            ("https://url/file.mxf", "_fetch_size_http"),
+            ("ftp://url/file.mxf", "_fetch_size_ftp"),
+        ],
+    )
+    def test_fetch_size_dispatch(self, url, method, transfer_message):
+        """The size is fetched by the (patched) method for the protocol."""
+        transfer_message["source"]["url"] = url
+        transfer = Transfer(transfer_message, MagicMock())
+        with patch.object(Transfer, method, return_value=1000) as method_mock:
+            assert transfer._fetch_size() == 1000
+        method_mock.assert_called_once_with()
+
+    def test_fetch_size_unknown_protocol(self, transfer_message):
+        transfer_message["source"]["url"] = "ldap://url/bucket/file.mxf"
+        transfer = Transfer(transfer_message, MagicMock())
+        with pytest.raises(ValueError) as e:
             transfer._fetch_size()
+        assert str(e.value) == "Protocol not supported: ldap://url/bucket/file.mxf"
 
     def test_prepare_target_transfer(self, transfer):
         """File does not exist and folder is created"""
@@ -290,16 +579,45 @@ class TestTransfer:
 
     def test_prepare_target_transfer_folder_exists(self, transfer):
         """File does not exist and tmp folder already exists."""
+        transfer.size_in_bytes = 1303
+        # Both parts were written in an earlier try of this transfer
+        transfer.written_parts = {(0, "0-326"), (1, "327-652")}
         sftp_mock = transfer.sftp
         # File not found but folder is found.
         sftp_mock.stat.side_effect = (FileNotFoundError, MagicMock)
         # mkdir results in OSError
         sftp_mock.mkdir.side_effect = OSError("error")
+        # First part is complete, second part is incomplete
+        part_0, part_1 = MagicMock(), MagicMock()
+        part_0.filename, part_0.st_size = "file.mxf.part0", 327
+        part_1.filename, part_1.st_size = "file.mxf.part1", 100
+        sftp_mock.listdir_attr.return_value = [part_0, part_1]
 
         transfer._prepare_target_transfer()
 
         assert sftp_mock.stat.call_count == 2
         sftp_mock.mkdir.assert_called_once_with("/s3-transfer-test/file.mxf.part")
+        sftp_mock.listdir_attr.assert_called_once_with(
+            "/s3-transfer-test/file.mxf.part"
+        )
+        assert transfer.transferred_parts == {0}
+
+    def test_prepare_target_transfer_folder_exists_other_transfer(self, transfer):
+        """Tmp folder already exists with parts not written by this transfer."""
+        transfer.size_in_bytes = 1303
+        sftp_mock = transfer.sftp
+        # File not found but folder is found.
+        sftp_mock.stat.side_effect = (FileNotFoundError, MagicMock)
+        # mkdir results in OSError
+        sftp_mock.mkdir.side_effect = OSError("error")
+        # Part of the right size, but left behind by another transfer
+        part_0 = MagicMock()
+        part_0.filename, part_0.st_size = "file.mxf.part0", 327
+        sftp_mock.listdir_attr.return_value = [part_0]
+
+        transfer._prepare_target_transfer()
+
+        assert transfer.transferred_parts == set()
 
     def test_prepare_target_transfer_folder_error(self, transfer, caplog):
         """File does not exist but tmp folder can't be created."""
@@ -328,17 +646,20 @@ class TestTransfer:
         """Transfer parts successfully."""
         transfer._transfer_parts()
 
+        # The parts are remembered as written by this transfer
+        assert transfer.written_parts == {(0, "0-1"), (1, "1-2")}
+
         log_records = caplog.records
         assert len(log_records) == 2
         for log_record in log_records:
             assert log_record.level == "debug"
 
         assert (
-            "Thread started for: /s3-transfer-test/file.mxf.part/file.mxf.part0"
+            "Part submitted: /s3-transfer-test/file.mxf.part/file.mxf.part0"
             in caplog.messages
         )
         assert (
-            "Thread started for: /s3-transfer-test/file.mxf.part/file.mxf.part1"
+            "Part submitted: /s3-transfer-test/file.mxf.part/file.mxf.part1"
             in caplog.messages
         )
 
@@ -354,10 +675,69 @@ class TestTransfer:
             "0-1",
         ) in call_args
 
+    @patch("app.helpers.transfer.Transfer._transfer_part")
+    @patch("app.helpers.transfer.calculate_ranges", return_value=["0-1", "1-2"])
+    def test_transfer_parts_resume(
+        self, calculate_ranges_mock, transfer_part_mock, transfer, caplog
+    ):
+        """Parts that are already transferred are skipped."""
+        transfer.transferred_parts = {0}
+
+        transfer._transfer_parts()
+
+        assert (
+            "Part already transferred: /s3-transfer-test/file.mxf.part/file.mxf.part0"
+            in caplog.messages
+        )
+        transfer_part_mock.assert_called_once_with(
+            "/s3-transfer-test/file.mxf.part/file.mxf.part1", "1-2"
+        )
+
+    @patch("app.helpers.transfer.Transfer._transfer_part")
+    @patch("app.helpers.transfer.calculate_ranges", return_value=["0-1", "1-2"])
+    def test_transfer_parts_error(
+        self, calculate_ranges_mock, transfer_part_mock, transfer, caplog
+    ):
+        """A part failed to transfer, so the transfer can be retried."""
+
+        def transfer_part(dest_file_full, part_range):
+            if part_range == "1-2":
+                raise TransferPartException
+
+        transfer_part_mock.side_effect = transfer_part
+
+        with pytest.raises(TransferException):
+            transfer._transfer_parts()
+
+        assert transfer_part_mock.call_count == 2
+        # The failed part is not remembered as written
+        assert (1, "1-2") not in transfer.written_parts
+        log_record = caplog.records[-1]
+        assert log_record.level == "error"
+        assert log_record.message == "Error occurred when transferring the parts"
+
+    @patch("app.helpers.transfer.Transfer._transfer_part")
+    @patch("app.helpers.transfer.calculate_ranges", return_value=["0-1", "1-2"])
+    def test_transfer_parts_permanent_error(
+        self, calculate_ranges_mock, transfer_part_mock, transfer
+    ):
+        """A part can't be transferred, which is raised as is."""
+        transfer_part_mock.side_effect = TransferPartPermanentException
+
+        with pytest.raises(TransferPartPermanentException):
+            transfer._transfer_parts()
+
+    @patch("app.helpers.transfer.build_finalize_command", return_value="finalize")
     @patch("app.helpers.transfer.build_assemble_command", return_value="cat")
-    def test_assemble_parts(self, build_assemble_command_mock, transfer, caplog):
+    def test_assemble_parts(
+        self, build_assemble_command_mock, build_finalize_command_mock, transfer, caplog
+    ):
         """Successfully assemble the parts."""
         stdin_mock, stdout_mock, stderr_mock = (MagicMock(), MagicMock(), MagicMock())
+        # Mock the size of the assembled file and the exit status
+        stdout_mock.readlines.return_value = ["1000\n"]
+        stdout_mock.channel.recv_exit_status.return_value = 0
+        stderr_mock.readlines.return_value = []
 
         # Mock exec command
         client_mock = transfer.remote_client
@@ -365,8 +745,6 @@ class TestTransfer:
 
         transfer.size_in_bytes = 1000
         sftp_mock = transfer.sftp
-        # Mock check filesize of transferred file
-        sftp_mock.stat.return_value.st_size = 1000
 
         transfer._assemble_parts()
 
@@ -376,44 +754,28 @@ class TestTransfer:
         assert log_record.message == "Start assembling the parts"
         assert log_record.destination == "/s3-transfer-test/file.mxf"
 
-        assert client_mock.exec_command.call_count == 2
-
-        # Check call of build assemble command
-        build_assemble_command_mock.assert_called_once_with(
-            "/s3-transfer-test/file.mxf.part", "file.mxf", 4
-        )
-
-        # Check if build command has executed
-        assert client_mock.exec_command.call_args_list[0].args == ("cat",)
+        # Assembling, checking the size, renaming, touching and cleaning up is
+        # one command
+        client_mock.exec_command.assert_called_once_with("cat && finalize")
+        sftp_mock.stat.assert_not_called()
+        sftp_mock.rename.assert_not_called()
+        sftp_mock.remove.assert_not_called()
+        sftp_mock.rmdir.assert_not_called()
 
         # Doesn't change in to dir
         sftp_mock.chdir.assert_not_called()
 
-        # Check if tmp file is correct size
-        sftp_mock.stat.assert_called_once_with(
-            "/s3-transfer-test/file.mxf.part/file.mxf.tmp",
-        )
-
-        # Check if tmp file renamed
-        sftp_mock.rename.assert_called_once_with(
-            "/s3-transfer-test/file.mxf.part/file.mxf.tmp", "/s3-transfer-test/file.mxf"
-        )
-
-        # Check if touch command has been executed
-        assert client_mock.exec_command.call_args_list[1].args == (
-            "touch '/s3-transfer-test/file.mxf'",
+        # Check call of build assemble command
+        build_assemble_command_mock.assert_called_once_with(
+            "/s3-transfer-test/file.mxf.part", "file.mxf", 4
         )
 
-        # Check if remove parts command has been executed for each part
-        assert sftp_mock.remove.call_count == 4
-        for idx, cargs in enumerate(sftp_mock.remove.call_args_list):
-            assert cargs.args == (
-                f"/s3-transfer-test/file.mxf.part/file.mxf.part{idx}",
-            )
-
-        # Check if tmp dir has been removed
-        sftp_mock.rmdir.assert_called_once_with(
+        # Check call of build finalize command
+        build_finalize_command_mock.assert_called_once_with(
             "/s3-transfer-test/file.mxf.part",
+            "file.mxf",
+            "/s3-transfer-test/file.mxf",
+            1000,
         )
 
         # Check logged message
@@ -428,21 +790,21 @@ class TestTransfer:
     ):
         """Assembled file has incorrect file size."""
         stdin_mock, stdout_mock, stderr_mock = (MagicMock(), MagicMock(), MagicMock())
+        # Mock the size of the assembled file and the failed size check
+        stdout_mock.readlines.return_value = ["500\n"]
+        stdout_mock.channel.recv_exit_status.return_value = 1
+        stderr_mock.readlines.return_value = []
 
         # Mock exec command
         client_mock = transfer.remote_client
         client_mock.exec_command.return_value = (stdin_mock, stdout_mock, stderr_mock)
 
         transfer.size_in_bytes = 1000
-        sftp_mock = transfer.sftp
-        # Mock check filesize of transferred file
-        sftp_mock.stat.return_value.st_size = 500
 
         with pytest.raises(TransferException):
             transfer._assemble_parts()
 
-        # Tmp file should not be renamed
-        sftp_mock.rename.assert_not_called()
+        assert client_mock.exec_command.call_count == 1
 
         # Check error log
         log_record = caplog.records[-1]
@@ -465,20 +827,51 @@ class TestTransfer:
         client_mock = transfer.remote_client
         client_mock.exec_command.return_value = (stdin_mock, stdout_mock, stderr_mock)
 
-        sftp_mock = transfer.sftp
-        # Checking filesize returns OSError
-        sftp_mock.stat.side_effect = OSError("error")
+        # Checking filesize results in an error
+        stdout_mock.readlines.return_value = []
+        stderr_mock.readlines.return_value = ["error"]
 
         with pytest.raises(TransferException):
             transfer._assemble_parts()
 
-        # Tmp file should not be renamed
-        sftp_mock.rename.assert_not_called()
+        assert client_mock.exec_command.call_count == 1
 
         # Check error log
         log_record = caplog.records[-1]
         assert log_record.level == "error"
-        assert log_record.message == "Error occurred when assembling parts: error"
+        assert (
+            log_record.message
+            == "Error occurred when assembling parts: Could not get size of assembled file: ['error']"
+        )
+
+    @patch("app.helpers.transfer.build_assemble_command", return_value="cat")
+    def test_assemble_parts_finalize_error(
+        self, build_assemble_command_mock, transfer, caplog
+    ):
+        """Size is correct but moving the file or cleaning up fails."""
+        stdin_mock, stdout_mock, stderr_mock = (MagicMock(), MagicMock(), MagicMock())
+        stdout_mock.readlines.return_value = ["1000\n"]
+        stdout_mock.channel.recv_exit_status.return_value = 1
+        stderr_mock.readlines.return_value = ["error"]
+
+        # Mock exec command
+        client_mock = transfer.remote_client
+        client_mock.exec_command.return_value = (stdin_mock, stdout_mock, stderr_mock)
+
+        transfer.size_in_bytes = 1000
+
+        with pytest.raises(TransferException):
+            transfer._assemble_parts()
+
+        assert client_mock.exec_command.call_count == 1
+
+        # Check error log
+        log_record = caplog.records[-1]
+        assert log_record.level == "error"
+        assert (
+            log_record.message
+            == "Error occurred when assembling parts: Could not finalize assembled file: ['error']"
+        )
 
     def test_check_target_folder(self, transfer):
         """Target folder exists."""
@@ -506,35 +899,26 @@ class TestTransfer:
     def test_check_free_space(self, sleep_mock, transfer, caplog):
         """
         Check the free space twice. First there will not be enough free space.
-        Then after a sleep, it will check again. The second check will return
-        enough free space.
+        Then the remote loop outputs the next check, which will return enough
+        free space.
         """
         # Mock exec command
-        stdin_mock, stdout_mock_no_space, stdout_mock_enough_space, stderr_mock = (
-            MagicMock(),
-            MagicMock(),
-            MagicMock(),
-            MagicMock(),
-        )
-        stdout_mock_no_space.readlines.return_value = [" 95%\n"]
-        stdout_mock_enough_space.readlines.return_value = [" 15%\n"]
+        stdin_mock, stdout_mock, stderr_mock = (MagicMock(), MagicMock(), MagicMock())
+        stdout_mock.__iter__.return_value = iter([" 95%\n", " 15%\n"])
 
         client_mock = transfer.remote_client
-
-        client_mock.exec_command.side_effect = [
-            (stdin_mock, stdout_mock_no_space, stderr_mock),
-            (stdin_mock, stdout_mock_enough_space, stderr_mock),
-        ]
+        client_mock.exec_command.return_value = (stdin_mock, stdout_mock, stderr_mock)
 
         transfer._check_free_space()
 
-        # Check executing the 'df' commands
-        assert transfer.remote_client.exec_command.call_count == 2
-        for args in transfer.remote_client.exec_command.call_args_list:
-            assert args.args[0] == "df --output=pcent /s3-transfer-test | tail -1"
+        # Check executing the 'df' loop once
+        client_mock.exec_command.assert_called_once_with(
+            build_free_space_command("/s3-transfer-test")
+        )
+        stdout_mock.channel.close.assert_called_once()
 
-        # Check time.sleep
-        sleep_mock.assert_called_once_with(120)
+        # Waiting happens remotely
+        sleep_mock.assert_not_called()
 
         # Check logs
         log_record = caplog.records[0]
@@ -544,6 +928,25 @@ class TestTransfer:
         assert log_record.level == "info"
         assert log_record.message == "Free space: 85%. Space needed: 15%"
 
+    @patch.dict(
+        "app.helpers.transfer.dest_conf",
+        {"free_space_percentage": "15"},
+    )
+    def test_check_free_space_no_output(self, transfer, caplog):
+        """The remote loop stops without outputting the used space."""
+        stdin_mock, stdout_mock, stderr_mock = (MagicMock(), MagicMock(), MagicMock())
+        stdout_mock.__iter__.return_value = iter([])
+
+        client_mock = transfer.remote_client
+        client_mock.exec_command.return_value = (stdin_mock, stdout_mock, stderr_mock)
+
+        transfer._check_free_space()
+
+        stdout_mock.channel.close.assert_called_once()
+        log_record = caplog.records[0]
+        assert log_record.level == "warning"
+        assert log_record.message == "Could not get used percentage"
+
     @patch.dict(
         "app.helpers.transfer.dest_conf",
         {"free_space_percentage": "", "file_system": ""},
@@ -555,6 +958,7 @@ class TestTransfer:
 
         assert not len(caplog.records)
 
+    @patch.object(Transfer, "_close_remote_client")
     @patch.object(Transfer, "_init_remote_client")
     @patch.object(Transfer, "_check_target_folder")
     @patch.object(Transfer, "_check_free_space")
@@ -571,6 +975,7 @@ class TestTransfer:
         check_free_space_mock,
         check_target_folder_mock,
         init_remote_client_mock,
+        close_remote_client_mock,
         transfer,
         caplog,
     ):
@@ -589,9 +994,9 @@ class TestTransfer:
         assert not transfer.source_password
 
         transfer.transfer()
-        # Initialisation of the remote client
-        assert init_remote_client_mock.call_count == 2
-        assert transfer.remote_client.close.call_count == 2
+        # Initialisation of the remote client, shared by all the steps
+        init_remote_client_mock.assert_called_once()
+        close_remote_client_mock.assert_called_once()
         # Check target folder
         check_target_folder_mock.assert_called_once()
         # Free space check
@@ -614,6 +1019,146 @@ class TestTransfer:
         )
 
         assert transfer.size_in_bytes == 100
+        # A small file is transferred in one part
+        assert transfer.number_parts == 1
+
+    @patch.object(Transfer, "_close_remote_client")
+    @patch.object(Transfer, "_init_remote_client")
+    @patch.object(Transfer, "_check_target_folder")
+    @patch.object(Transfer, "_check_free_space")
+    @patch.object(Transfer, "_fetch_size")
+    @patch.object(Transfer, "_prepare_target_transfer")
+    def test_transfer_fetch_size_error(
+        self,
+        prepare_target_transfer_mock,
+        fetch_size_mock,
+        check_free_space_mock,
+        check_target_folder_mock,
+        init_remote_client_mock,
+        close_remote_client_mock,
+        transfer,
+    ):
+        """An error while fetching the size in the background is raised."""
+        fetch_size_mock.side_effect = ValueError("Protocol not supported: sftp")
+
+        with pytest.raises(ValueError):
+            transfer.transfer()
+
+        init_remote_client_mock.assert_called_once()
+        check_free_space_mock.assert_called_once()
+        prepare_target_transfer_mock.assert_not_called()
+        close_remote_client_mock.assert_called_once()
+
+    @patch("time.sleep")
+    @patch.object(Transfer, "_close_remote_client")
+    @patch.object(Transfer, "_init_remote_client")
+    @patch.object(Transfer, "_check_target_folder")
+    @patch.object(Transfer, "_check_free_space")
+    @patch.object(Transfer, "_fetch_size", return_value=100)
+    @patch.object(Transfer, "_prepare_target_transfer")
+    @patch.object(Transfer, "_transfer_parts", side_effect=TransferException)
+    def test_transfer_retry(
+        self,
+        transfer_parts_mock,
+        prepare_target_transfer_mock,
+        fetch_size_mock,
+        check_free_space_mock,
+        check_target_folder_mock,
+        init_remote_client_mock,
+        close_remote_client_mock,
+        sleep_mock,
+        transfer,
+    ):
+        """A failed transfer is retried with an exponential backoff."""
+        with pytest.raises(TransferException):
+            transfer.transfer()
+
+        assert transfer_parts_mock.call_count == 3
+        assert close_remote_client_mock.call_count == 3
+        # The delay doubles between the tries, with a jitter added to it
+        delays = [call.args[0] for call in sleep_mock.call_args_list]
+        assert len(delays) == 2
+        assert delays[0] == 3
+        assert 6 <= delays[1] <= 7
+
+    def test_init_remote_client(self, transfer, pool):
+        """The SSH client is acquired from the pool."""
+        client_mock = transfer.remote_client
+        assert pool.client_keys[client_mock] == ("tst-server", 22, "ssh_user")
+        client_mock.connect.assert_called_once_with(
+            "tst-server", port=22, username="ssh_user", password="ssh_pass"
+        )
+        assert transfer.sftp == client_mock.open_sftp()
+
+    @patch("app.helpers.ssh_pool.SSHClient")
+    def test_init_remote_client_stale(
+        self, ssh_client_mock, transfer_message, pool, caplog
+    ):
+        """A pooled connection that was dropped is discarded and replaced."""
+        stale_client = MagicMock()
+        stale_client.get_transport().is_active.return_value = True
+        stale_client.open_sftp.side_effect = SSHException("SSH session not active")
+        pool.idle_clients[("tst-server", 22, "ssh_user")].append(stale_client)
+        new_client = MagicMock()
+        ssh_client_mock.return_value = new_client
+        vault_mock = MagicMock()
+        vault_mock.get_username.return_value = "ssh_user"
+        vault_mock.get_password.return_value = "ssh_pass"
+        transfer = Transfer(transfer_message, vault_mock)
+
+        transfer._init_remote_client()
+
+        stale_client.close.assert_called_once()
+        assert stale_client not in pool.client_keys
+        new_client.connect.assert_called_once()
+        assert transfer.remote_client == new_client
+        assert transfer.sftp == new_client.open_sftp()
+        assert (
+            "SSH connection not usable, reconnecting: SSH session not active"
+            in caplog.messages
+        )
+
+    @patch("app.helpers.ssh_pool.SSHClient")
+    def test_init_remote_client_sftp_error(
+        self, ssh_client_mock, transfer_message, pool, caplog
+    ):
+        """The SFTP client can't be opened on a new connection either."""
+        client = ssh_client_mock()
+        client.open_sftp.side_effect = SSHException("Channel closed.")
+        vault_mock = MagicMock()
+        vault_mock.get_username.return_value = "ssh_user"
+        vault_mock.get_password.return_value = "ssh_pass"
+        transfer = Transfer(transfer_message, vault_mock)
+
+        transfer.remote_client = previous_client = MagicMock()
+
+        with pytest.raises(TransferException):
+            transfer._init_remote_client()
+
+        assert client.connect.call_count == 2
+        assert client.close.call_count == 2
+        assert transfer.remote_client == previous_client
+        assert not pool.client_keys
+        assert (
+            "SSH Error occurred when opening SFTP: Channel closed." in caplog.messages
+        )
+
+    def test_close_remote_client(self, transfer, pool):
+        """The SSH client is released back into the pool."""
+        client_mock = transfer.remote_client
+        sftp_mock = transfer.sftp
+
+        transfer._close_remote_client()
+
+        sftp_mock.close.assert_called_once()
+        client_mock.close.assert_not_called()
+        assert client_mock in pool.idle_clients[("tst-server", 22, "ssh_user")]
+        assert transfer.remote_client is None
+        assert transfer.sftp is None
+
+        # Closing again doesn't touch the released SSH client
+        transfer._close_remote_client()
+        client_mock.close.assert_not_called()
 
     def test_transfer_from_message_credentials(self, transfer_message):
         """
@@ -41,6 +41,53 @@ class TestPulsarClient:
             event_timestamp=event.get_event_time_as_int(),
         )
 
+    @patch("app.services.pulsar.PulsarBinding")
+    def test_produce_event_existing_producer(self, pulsar_binding_mock, pulsar_client):
+        """Produce a cloudevent.
+
+        Producer for the topic already exists, so it is reused.
+        """
+        event = MagicMock()
+        message = MagicMock()
+        pulsar_binding_mock.to_protocol.return_value = message
+        producer = MagicMock()
+        topic = "tst-topic"
+        pulsar_client.producers[topic] = producer
+
+        pulsar_client.produce_event(topic, event)
+        pulsar_client.client.create_producer.assert_not_called()
+        producer.send.assert_called_once_with(
+            message.data,
+            properties=message.attributes,
+            event_timestamp=event.get_event_time_as_int(),
+        )
+
+    @patch("app.services.pulsar.PulsarBinding")
+    def test_produce_event_producer_created_meanwhile(
+        self, pulsar_binding_mock, pulsar_client
+    ):
+        """Produce a cloudevent.
+
+        Another thread creates the producer for the topic while waiting for the
+        lock, so it is reused instead of creating a second one.
+        """
+        event = MagicMock()
+        topic = "tst-topic"
+        producer = MagicMock()
+
+        def other_thread_wins(*args):
+            pulsar_client.producers[topic] = producer
+
+        lock_mock = MagicMock()
+        lock_mock.__enter__.side_effect = other_thread_wins
+        pulsar_client.producers_lock = lock_mock
+
+        pulsar_client.produce_event(topic, event)
+
+        lock_mock.__enter__.assert_called_once()
+        pulsar_client.client.create_producer.assert_not_called()
+        producer.send.assert_called_once()
+
     def test_close(self, pulsar_client):
         """Test that all producers were closed."""
         producer_1 = MagicMock()
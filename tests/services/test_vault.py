@@ -28,6 +28,7 @@ class TestPulsarClient:
             }
         )
         assert len(vault_client.secrets) == 0
+        assert vault_client.secret_ttl == 300
 
     def test_fetch_secret(self, vault_client: VaultClient):
         path = "engine/name"
@@ -38,6 +39,38 @@ class TestPulsarClient:
             **{"path": "name", "mount_point": "engine"}
         )
 
+    def test_fetch_secret_cached(self, vault_client: VaultClient):
+        """Fetching the same secret twice only reads it once from Vault."""
+        path = "engine/name"
+        vault_client.fetch_secret(path)
+        vault_client.fetch_secret(path)
+        assert vault_client.client.secrets.kv.v2.read_secret.call_count == 1
+
+    @patch("time.monotonic")
+    def test_fetch_secret_expired(self, monotonic_mock, vault_client: VaultClient):
+        """A cached secret older than the TTL is read again from Vault."""
+        path = "engine/name"
+        monotonic_mock.return_value = 1000
+        vault_client.fetch_secret(path)
+        monotonic_mock.return_value = 1300
+        vault_client.fetch_secret(path)
+        assert vault_client.client.secrets.kv.v2.read_secret.call_count == 1
+        monotonic_mock.return_value = 1301
+        vault_client.fetch_secret(path)
+        assert vault_client.client.secrets.kv.v2.read_secret.call_count == 2
+
+    def test_invalidate(self, vault_client: VaultClient):
+        """An invalidated secret is read again from Vault."""
+        path = "engine/name"
+        vault_client.fetch_secret(path)
+        vault_client.invalidate(path)
+        assert path not in vault_client.secrets
+        vault_client.fetch_secret(path)
+        assert vault_client.client.secrets.kv.v2.read_secret.call_count == 2
+
+        # Invalidating an unknown secret is a no-op
+        vault_client.invalidate("engine/unknown")
+
     def test_get_username(self, vault_client: VaultClient):
         path = "path"
         vault_client.secrets["path"] = {"data": {"username": "user"}, "metadata": {}}